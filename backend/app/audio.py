@@ -0,0 +1,137 @@
+import logging
+import mmap
+import shutil
+import struct
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+
+
+logger = logging.getLogger(__name__)
+
+# Vosk expects 16kHz mono 16-bit PCM
+VOSK_SAMPLE_RATE = 16000
+BLOCK_SIZE = 65536  # samples per streamed block
+
+def ffmpeg_available() -> bool:
+    """Check whether ffmpeg is on PATH"""
+    return shutil.which("ffmpeg") is not None
+
+def is_vosk_wav(info) -> bool:
+    """Check whether sf.info() describes a 16kHz mono PCM_16 WAV Vosk can read as-is"""
+    return (info is not None and info.format == 'WAV' and info.samplerate == VOSK_SAMPLE_RATE
+            and info.channels == 1 and info.subtype == 'PCM_16')
+
+def _pcm_data_range(buf) -> Tuple[int, int]:
+    """Locate the sample bytes of a 16kHz mono PCM_16 WAV from its RIFF chunks"""
+    if buf[0:4] != b'RIFF' or buf[8:12] != b'WAVE':
+        raise ValueError("Not a WAV file")
+
+    offset = 12
+    fmt_checked = False
+    while offset + 8 <= len(buf):
+        chunk_id = buf[offset:offset + 4]
+        size = struct.unpack_from('<I', buf, offset + 4)[0]
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            audio_format, channels, sample_rate = struct.unpack_from('<HHI', buf, body)
+            bits = struct.unpack_from('<H', buf, body + 14)[0]
+            # 0xFFFE is WAVE_FORMAT_EXTENSIBLE, used by some writers for plain PCM
+            if audio_format not in (1, 0xFFFE) or (channels, sample_rate, bits) != (1, VOSK_SAMPLE_RATE, 16):
+                raise ValueError("WAV is not 16kHz mono PCM_16")
+            fmt_checked = True
+        elif chunk_id == b'data':
+            if not fmt_checked:
+                raise ValueError("WAV data chunk comes before its format chunk")
+            # Writers that never patched the size leave it larger than the file,
+            # and a truncated file can end in the middle of a sample
+            end = min(body + size, len(buf))
+            return body, end - ((end - body) & 1)
+        # Chunks are padded to an even length
+        offset = body + size + (size & 1)
+
+    raise ValueError("WAV file has no data chunk")
+
+@contextmanager
+def mmap_wav_pcm(path: str) -> Iterator[memoryview]:
+    """Map a 16kHz mono PCM_16 WAV and yield a zero-copy view of its samples.
+
+    The page cache holds the samples instead of a bytes copy of the whole
+    recording. The view is released and the file unmapped when the with
+    block ends, so callers must not keep arrays or views derived from it.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start, end = _pcm_data_range(mm)
+        view = memoryview(mm)[start:end]
+        try:
+            yield view
+        finally:
+            view.release()
+
+def load_mono_16k(path: str) -> np.ndarray:
+    """Decode audio to float32 mono samples at 16kHz.
+
+    Formats libsndfile can read go through soundfile and a polyphase
+    resampler; librosa is only used for codecs libsndfile doesn't support.
+    """
+    try:
+        data, sample_rate = sf.read(path, dtype='float32', always_2d=False)
+    except sf.LibsndfileError:
+        import librosa
+        data, _ = librosa.load(path, sr=VOSK_SAMPLE_RATE, mono=True)
+        return data
+
+    if data.ndim == 2:
+        data = data.mean(axis=1)
+    if sample_rate != VOSK_SAMPLE_RATE:
+        data = resample_poly(data, VOSK_SAMPLE_RATE, sample_rate).astype(np.float32, copy=False)
+    return data
+
+def stream_convert_to_wav(src_path: str, dst_path: str, blocksize: int = BLOCK_SIZE) -> int:
+    """Convert audio to a 16kHz mono PCM_16 WAV file block by block.
+
+    ffmpeg decodes and resamples the input and its raw s16le output is
+    streamed straight into the WAV file, so peak memory is bounded by
+    the block size instead of the recording length. Returns the number
+    of samples written.
+    """
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error",
+        "-i", src_path,
+        "-ar", str(VOSK_SAMPLE_RATE), "-ac", "1", "-f", "s16le", "-"
+    ]
+
+    frames = 0
+    # stderr goes to a file, a full stderr pipe would stall ffmpeg before it
+    # closes stdout and hang the read loop below
+    with tempfile.TemporaryFile() as err_file, \
+            subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err_file) as proc:
+        with sf.SoundFile(dst_path, 'w', samplerate=VOSK_SAMPLE_RATE, channels=1,
+                          subtype='PCM_16', format='WAV') as out:
+            # Read ffmpeg output into one buffer reused for every block
+            buf = np.empty(blocksize, dtype=np.int16)
+            view = memoryview(buf).cast('B')
+            try:
+                while True:
+                    n_bytes = proc.stdout.readinto(view)
+                    if not n_bytes:
+                        break
+                    n_samples = n_bytes // 2
+                    out.write(buf[:n_samples])
+                    frames += n_samples
+            finally:
+                view.release()
+        proc.wait()
+        err_file.seek(0)
+        stderr = err_file.read()
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {proc.returncode}: {stderr.decode(errors='replace').strip()}")
+
+    logger.info("Streamed %d samples from %s to %s", frames, src_path, dst_path)
+    return frames
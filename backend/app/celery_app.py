@@ -0,0 +1,36 @@
+import os
+
+from celery import Celery
+
+# Redis is used both as the message broker and the result backend so that
+# progress/results are shared between API and worker processes
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+# How long task progress/results are kept, in seconds
+RESULT_TTL = 60 * 60
+
+celery_app = Celery(
+    "vet_scribe",
+    broker=REDIS_URL,
+    backend=REDIS_URL,
+    include=["app.tasks"],
+)
+
+celery_app.conf.update(
+    task_serializer="json",
+    result_serializer="json",
+    accept_content=["json"],
+    # Transcriptions are long and CPU-bound, don't let a worker hoard queued tasks
+    worker_prefetch_multiplier=1,
+    # The soft limit raises SoftTimeLimitExceeded inside the task a minute
+    # before the hard kill, so its finally blocks still remove the upload
+    task_soft_time_limit=29 * 60,
+    task_time_limit=30 * 60,
+    result_expires=RESULT_TTL,
+    # Decode and transcribe run on separate queues so the two stages of
+    # consecutive uploads overlap
+    task_routes={
+        "app.tasks.convert_audio": {"queue": "decode"},
+        "app.tasks.transcribe_audio": {"queue": "transcribe"},
+    },
+)
@@ -1,32 +1,73 @@
-import asyncio
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 import os
-import json
+import shutil
 import tempfile
 import logging
+import time
 from pathlib import Path
 from typing import Dict, Optional, List
 from pydantic import BaseModel
-import uuid
 from datetime import datetime
+from celery.result import AsyncResult
+import aiofiles
+import orjson
+import redis.asyncio as aioredis
 
-from .transcription import VoskTranscriber
-from .ner_processor import BioBERTProcessor
+from .celery_app import REDIS_URL, RESULT_TTL, celery_app
+from .tasks import start_transcription
 from .models import TranscriptionResponse
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SUPPORTED_EXTENSIONS = frozenset({'.wav', '.mp3', '.m4a', '.ogg', '.webm'})
+
+# Upload part content types accepted by /transcribe. application/octet-stream
+# is what curl and some clients send when they don't know the type, so those
+# uploads are checked by extension only.
+ALLOWED_CONTENT_TYPES = frozenset({
+    'audio/wav', 'audio/x-wav', 'audio/wave', 'audio/vnd.wave',
+    'audio/mpeg', 'audio/mp3',
+    'audio/mp4', 'audio/m4a', 'audio/x-m4a',
+    'audio/ogg',
+    'audio/webm', 'video/webm',
+    'application/octet-stream',
+})
+
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+
+# Uploads are written to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Sorted set of task ids scored by submission time, shared by all API workers
+TASK_INDEX_KEY = "vet_scribe:tasks"
+
+# Idle progress streams send a keepalive comment at this interval
+SSE_KEEPALIVE_SECONDS = 15.0
+
 app = FastAPI(
     title="Vet Voice Transcription API",
     description="AI-powered veterinary voice transcription with medical entity extraction",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson serializes the nested progress/results dicts much faster than stdlib json
+    default_response_class=ORJSONResponse
 )
 
-# CORS configuration
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject oversized uploads from their Content-Length before the body is read"""
+    if request.method == "POST" and request.url.path == "/transcribe":
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+            return JSONResponse(status_code=413, content={"detail": "Audio file too large"})
+    
+    return await call_next(request)
+
+# CORS configuration (added last so it also wraps the responses above)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "https://your-frontend-domain.vercel.app"],
@@ -35,13 +76,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize processors
-transcriber = None
-ner_processor = None
-
-# Global progress tracking
-task_progress: Dict[str, Dict] = {}
-
 # Add a new response model for task-based transcription
 class TaskResponse(BaseModel):
     task_id: str
@@ -56,18 +90,62 @@ class ProgressUpdate(BaseModel):
     timestamp: str
     details: Optional[Dict] = None
 
+# Redis client for the task index
+redis_client = None
+
 @app.on_event("startup")
 async def startup_event():
-    global transcriber, ner_processor
-    logger.info("Initializing transcription and NER processors...")
-    
-    try:
-        transcriber = VoskTranscriber()
-        ner_processor = BioBERTProcessor()
-        logger.info("Processors initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize processors: {str(e)}")
-        raise
+    global redis_client
+    redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if redis_client is not None:
+        await redis_client.aclose()
+
+async def register_task(task_id: str):
+    """Add a task to the shared index, dropping entries whose results have expired"""
+    now = time.time()
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.zadd(TASK_INDEX_KEY, {task_id: now})
+        pipe.zremrangebyscore(TASK_INDEX_KEY, 0, now - RESULT_TTL)
+        pipe.expire(TASK_INDEX_KEY, RESULT_TTL)
+        await pipe.execute()
+
+async def task_exists(task_id: str) -> bool:
+    """Check whether a task was submitted and its results have not expired"""
+    score = await redis_client.zscore(TASK_INDEX_KEY, task_id)
+    return score is not None and score > time.time() - RESULT_TTL
+
+def progress_from_state(state: str, info) -> Dict:
+    """Build a progress record from a Celery task state and its info/result"""
+    if state == "FAILURE":
+        return {
+            "stages": [],
+            "current_stage": "error",
+            "overall_progress": 0,
+            "status": "error",
+            "error": str(info)
+        }
+
+    if isinstance(info, dict) and "stages" in info:
+        return info
+
+    # Queued tasks are PENDING until a worker reports progress
+    return {
+        "stages": [],
+        "current_stage": "queued",
+        "overall_progress": 0,
+        "status": "processing"
+    }
+
+def get_task_progress(task_id: str) -> Dict:
+    """Read progress for a task from the Celery result backend"""
+    result = AsyncResult(task_id, app=celery_app)
+    return progress_from_state(result.state, result.info)
+
+# Celery broker/backend calls are blocking, so handlers run them in the threadpool
+# to keep the event loop free for other requests
 
 @app.get("/")
 async def root():
@@ -76,245 +154,97 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    workers = await run_in_threadpool(celery_app.control.ping, timeout=1.0)
     return {
         "status": "healthy",
-        "transcriber_ready": transcriber is not None and transcriber.model_loaded,
-        "ner_ready": ner_processor is not None,
+        "workers_ready": len(workers) > 0,
+        "workers": len(workers),
         "timestamp": datetime.now().isoformat()
     }
 
 @app.get("/progress/{task_id}")
 async def get_progress(task_id: str):
     """Get progress for a specific task"""
-    if task_id not in task_progress:
+    if not await task_exists(task_id):
         raise HTTPException(status_code=404, detail="Task not found")
     
-    return task_progress[task_id]
+    return await run_in_threadpool(get_task_progress, task_id)
 
-@app.get("/test")
-async def test_endpoint():
-    """Test endpoint"""
-    return {"message": "Backend is working!"}
-
-def update_progress(task_id: str, stage: str, progress: int, message: str, details: Optional[Dict] = None):
-    """Update progress for a specific task"""
-    if task_id not in task_progress:
-        task_progress[task_id] = {
-            "stages": [],
-            "current_stage": stage,
-            "overall_progress": progress,
-            "status": "processing",
-            "start_time": datetime.now().isoformat(),
-            "last_update": datetime.now().isoformat()
-        }
-    
-    task_progress[task_id]["stages"].append({
-        "stage": stage,
-        "progress": progress,
-        "message": message,
-        "timestamp": datetime.now().isoformat(),
-        "details": details or {}
-    })
+@app.get("/progress/{task_id}/stream")
+async def stream_progress(task_id: str):
+    """Stream progress for a task as Server-Sent Events"""
+    if not await task_exists(task_id):
+        raise HTTPException(status_code=404, detail="Task not found")
     
-    task_progress[task_id]["current_stage"] = stage
-    task_progress[task_id]["overall_progress"] = progress
-    task_progress[task_id]["last_update"] = datetime.now().isoformat()
+    # The Redis result backend publishes every state update on the task's key
+    channel = celery_app.backend.get_key_for_task(task_id)
     
-    logger.info(f"Task {task_id}: {stage} - {progress}% - {message}")
-
-async def process_transcription_task(task_id: str, file_path: str):
-    """Background task to process transcription with detailed progress tracking"""
-    try:
-        # Stage 1: File validation and preparation
-        update_progress(task_id, "file_preparation", 10, "Validating uploaded audio file")
-        await asyncio.sleep(0.5)  # Simulate processing time
-        
-        if not os.path.exists(file_path):
-            update_progress(task_id, "error", 0, "Audio file not found")
-            return
-        
-        file_size = os.path.getsize(file_path)
-        update_progress(task_id, "file_preparation", 20, f"Audio file validated ({file_size} bytes)")
-        
-        # Stage 2: Audio conversion
-        update_progress(task_id, "audio_conversion", 30, "Converting audio to WAV format")
-        await asyncio.sleep(0.5)
-        
+    async def event_stream():
+        pubsub = redis_client.pubsub()
         try:
-            import librosa
-            import soundfile as sf
-            
-            # Detect the actual file format and handle conversion properly
-            update_progress(task_id, "audio_conversion", 35, "Detecting audio format and loading audio")
-            
-            # Verify file exists and has content
-            if not os.path.exists(file_path):
-                error_msg = f"Audio file not found: {file_path}"
-                logger.error(f"File not found for task {task_id}: {error_msg}")
-                update_progress(task_id, "error", 0, error_msg)
-                return
+            # Subscribe before reading the current state so no update is missed
+            await pubsub.subscribe(channel)
+            progress = await run_in_threadpool(get_task_progress, task_id)
+            yield b"data: " + orjson.dumps(progress) + b"\n\n"
             
-            file_size = os.path.getsize(file_path)
-            if file_size == 0:
-                error_msg = "Audio file is empty"
-                logger.error(f"Empty file for task {task_id}: {error_msg}")
-                update_progress(task_id, "error", 0, error_msg)
-                return
-            
-            logger.info(f"File exists: {file_path}, size: {file_size} bytes")
-            
-            # Load audio with librosa (it can handle multiple formats)
-            try:
-                logger.info(f"Attempting to load audio file: {file_path}")
-                audio_data, sample_rate = librosa.load(file_path, sr=16000, mono=True)
-                update_progress(task_id, "audio_conversion", 40, f"Audio loaded: {sample_rate}Hz, {len(audio_data)/sample_rate:.2f}s")
-            except Exception as load_error:
-                error_msg = f"Failed to load audio file: {str(load_error)}"
-                logger.error(f"Audio loading error for task {task_id}: {error_msg}")
-                update_progress(task_id, "error", 0, error_msg)
-                return
-            
-            # Save as WAV file for Vosk
-            converted_path = file_path.replace('.wav', '_converted.wav')
-            # Handle different file extensions properly
-            if file_path.endswith('.webm'):
-                converted_path = file_path.replace('.webm', '_converted.wav')
-            elif file_path.endswith('.mp3'):
-                converted_path = file_path.replace('.mp3', '_converted.wav')
-            elif file_path.endswith('.m4a'):
-                converted_path = file_path.replace('.m4a', '_converted.wav')
-            elif file_path.endswith('.ogg'):
-                converted_path = file_path.replace('.ogg', '_converted.wav')
-            
-            try:
-                sf.write(converted_path, audio_data, sample_rate, subtype='PCM_16')
-                update_progress(task_id, "audio_conversion", 50, "Audio converted successfully")
-                update_progress(task_id, "audio_conversion", 60, f"Sample rate: {sample_rate}Hz, Duration: {len(audio_data)/sample_rate:.2f}s")
-            except Exception as write_error:
-                error_msg = f"Failed to save converted audio: {str(write_error)}"
-                logger.error(f"Audio write error for task {task_id}: {error_msg}")
-                update_progress(task_id, "error", 0, error_msg)
-                return
-            
-        except Exception as e:
-            error_msg = f"Audio conversion failed: {str(e)}"
-            logger.error(f"Audio conversion error for task {task_id}: {error_msg}")
-            update_progress(task_id, "error", 0, error_msg)
-            return
-        
-        # Stage 3: Vosk model loading check
-        update_progress(task_id, "model_loading", 70, "Checking Vosk transcription model")
-        await asyncio.sleep(0.5)
-        
-        if not transcriber.model_loaded:
-            update_progress(task_id, "error", 0, "Vosk model not loaded")
-            return
-        
-        update_progress(task_id, "model_loading", 80, "Vosk model ready for transcription")
-        
-        # Stage 4: Transcription
-        update_progress(task_id, "transcription", 85, "Starting speech-to-text transcription")
-        await asyncio.sleep(0.5)
-        
-        try:
-            # Use the converted WAV file for transcription
-            transcript = transcriber.transcribe(converted_path)
-            if not transcript or transcript.strip() == "":
-                update_progress(task_id, "error", 0, "Transcription failed - no speech detected")
-                return
-            
-            update_progress(task_id, "transcription", 90, f"Transcription completed: {len(transcript)} characters")
-            update_progress(task_id, "transcription", 95, f"Transcript preview: {transcript[:100]}...")
-            
-        except Exception as e:
-            error_msg = f"Transcription failed: {str(e)}"
-            logger.error(f"Transcription error for task {task_id}: {error_msg}")
-            update_progress(task_id, "error", 0, error_msg)
-            return
-        
-        # Stage 5: NER processing
-        update_progress(task_id, "ner_processing", 96, "Extracting medical entities")
-        await asyncio.sleep(0.5)
-        
-        try:
-            entities = ner_processor.extract_entities(transcript)
-            update_progress(task_id, "ner_processing", 98, f"Found {len(entities)} medical entities")
-            
-        except Exception as e:
-            update_progress(task_id, "error", 0, f"NER processing failed: {str(e)}")
-            return
-        
-        # Stage 6: Final processing
-        update_progress(task_id, "final_processing", 99, "Generating final results")
-        await asyncio.sleep(0.5)
-        
-        # Generate diagnosis and treatment suggestions
-        diagnosis = "Based on the transcription, please consult with a veterinarian for proper diagnosis."
-        treatment = "Treatment recommendations should be provided by a qualified veterinarian."
-        
-        # Store final results
-        task_progress[task_id]["results"] = {
-            "transcript": transcript,
-            "diagnosis": diagnosis,
-            "treatment": treatment,
-            "entities": entities
-        }
-        
-        update_progress(task_id, "completed", 100, "Processing completed successfully")
-        task_progress[task_id]["status"] = "completed"
-        
-        # Cleanup temporary files
-        try:
-            os.remove(file_path)
-            if os.path.exists(converted_path):
-                os.remove(converted_path)
-        except:
-            pass
-            
-    except Exception as e:
-        logger.error(f"Task {task_id} failed: {str(e)}")
-        update_progress(task_id, "error", 0, f"Processing failed: {str(e)}")
-        task_progress[task_id]["status"] = "error"
+            while progress["status"] == "processing":
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=SSE_KEEPALIVE_SECONDS)
+                if message is None:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield b": keepalive\n\n"
+                    continue
+                
+                meta = celery_app.backend.decode_result(message["data"])
+                progress = progress_from_state(meta["status"], meta["result"])
+                yield b"data: " + orjson.dumps(progress) + b"\n\n"
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.get("/test")
+async def test_endpoint():
+    """Test endpoint"""
+    return {"message": "Backend is working!"}
 
 @app.post("/transcribe")
-async def transcribe_audio(file: UploadFile = File(...), background_tasks: BackgroundTasks = BackgroundTasks()):
+async def transcribe_audio(file: UploadFile = File(...)):
     """
     Transcribe audio file and extract medical entities
     """
-    if not file.filename.lower().endswith((
-        '.wav', '.mp3', '.m4a', '.ogg', '.webm')):
+    # Keep the uploaded file's extension so the decoder can detect the format
+    file_extension = os.path.splitext(file.filename.lower())[1]
+    if file_extension not in SUPPORTED_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Unsupported audio format")
     
+    content_type = (file.content_type or "").split(";")[0].strip().lower()
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail="Unsupported audio MIME type")
+    
+    # Catches chunked uploads that had no Content-Length for the middleware to check
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Audio file too large")
+    
+    # Each upload gets its own temp directory, removed by the worker with
+    # the converted WAV once the pipeline finishes
+    upload_dir = tempfile.mkdtemp(prefix="vet_scribe_")
+    temp_file_path = os.path.join(upload_dir, f"upload{file_extension}")
+    # Set once the pipeline is queued, from then on the workers own the files
+    task_id = None
+    
     try:
-        # Generate task ID
-        task_id = str(uuid.uuid4())
-        
-        # Determine the correct file extension from the uploaded file
-        original_filename = file.filename.lower()
-        if original_filename.endswith('.webm'):
-            file_extension = '.webm'
-        elif original_filename.endswith('.mp3'):
-            file_extension = '.mp3'
-        elif original_filename.endswith('.m4a'):
-            file_extension = '.m4a'
-        elif original_filename.endswith('.ogg'):
-            file_extension = '.ogg'
-        else:
-            file_extension = '.wav'  # Default fallback
-        
-        # Save uploaded file temporarily with correct extension
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        # Save uploaded file temporarily with correct extension, streaming it
+        # in 1 MB chunks so concurrent uploads don't serialize on disk writes
+        async with aiofiles.open(temp_file_path, 'wb') as temp_file:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await temp_file.write(chunk)
         
-        logger.info(f"Starting transcription task {task_id} for file: {file.filename} (saved as {temp_file_path})")
+        # Queue the pipeline on the Celery workers
+        task_id = await run_in_threadpool(start_transcription, temp_file_path)
+        await register_task(task_id)
         
-        # Initialize progress tracking
-        update_progress(task_id, "started", 0, f"Task started for file: {file.filename}")
-        
-        # Add background task
-        background_tasks.add_task(process_transcription_task, task_id, temp_file_path)
+        logger.info(f"Started transcription task {task_id} for file: {file.filename} (saved as {temp_file_path})")
         
         return TaskResponse(
             task_id=task_id,
@@ -324,15 +254,17 @@ async def transcribe_audio(file: UploadFile = File(...), background_tasks: Backg
         
     except Exception as e:
         logger.error(f"Error starting transcription: {str(e)}")
+        if task_id is None:
+            shutil.rmtree(upload_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=f"Failed to start transcription: {str(e)}")
 
 @app.get("/results/{task_id}")
 async def get_results(task_id: str):
     """Get final results for a completed task"""
-    if task_id not in task_progress:
+    if not await task_exists(task_id):
         raise HTTPException(status_code=404, detail="Task not found")
     
-    task_data = task_progress[task_id]
+    task_data = await run_in_threadpool(get_task_progress, task_id)
     
     if task_data["status"] != "completed":
         raise HTTPException(status_code=400, detail="Task not completed yet")
@@ -348,19 +280,21 @@ async def get_results(task_id: str):
 @app.get("/tasks")
 async def list_tasks():
     """List all tasks and their status"""
-    return {
-        "tasks": [
-            {
-                "task_id": task_id,
-                "status": data["status"],
-                "current_stage": data.get("current_stage", ""),
-                "progress": data.get("overall_progress", 0),
-                "start_time": data.get("start_time", ""),
-                "last_update": data.get("last_update", "")
-            }
-            for task_id, data in task_progress.items()
-        ]
-    }
+    task_ids = await redis_client.zrangebyscore(TASK_INDEX_KEY, time.time() - RESULT_TTL, "+inf")
+    
+    tasks = []
+    for task_id in task_ids:
+        data = await run_in_threadpool(get_task_progress, task_id)
+        tasks.append({
+            "task_id": task_id,
+            "status": data["status"],
+            "current_stage": data.get("current_stage", ""),
+            "progress": data.get("overall_progress", 0),
+            "start_time": data.get("start_time", ""),
+            "last_update": data.get("last_update", "")
+        })
+    
+    return {"tasks": tasks}
 
 if __name__ == "__main__":
     import uvicorn
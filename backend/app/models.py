@@ -9,5 +9,5 @@ class TranscriptionResponse(BaseModel):
     
 class HealthResponse(BaseModel):
     status: str
-    transcriber_ready: bool
-    ner_ready: bool
\ No newline at end of file
+    workers_ready: bool
+    workers: int
\ No newline at end of file
@@ -1,13 +1,67 @@
 from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
+import ahocorasick
 import logging
+import os
 import re
-from typing import Dict, List
+from functools import lru_cache
+from typing import Dict, List, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Common veterinary diagnosis keywords
+DIAGNOSIS_KEYWORDS: Tuple[str, ...] = (
+    'fever', 'anemia', 'infection', 'inflammation', 'arthritis',
+    'dermatitis', 'gastritis', 'pneumonia', 'diabetes', 'cancer',
+    'tumor', 'fracture', 'wound', 'allergy', 'parasites', 'fleas',
+    'ticks', 'worms', 'diarrhea', 'vomiting', 'seizure', 'lameness',
+    'lethargy', 'elevated temperature', 'temperature'
+)
+
+# Common treatment keywords
+TREATMENT_KEYWORDS: Tuple[str, ...] = (
+    'antibiotic', 'antibiotics', 'doxycycline', 'amoxicillin',
+    'prednisone', 'surgery', 'vaccination', 'medication', 'treatment',
+    'therapy', 'rest', 'diet', 'exercise', 'bandage', 'cast',
+    'fluids', 'pain relief', 'anti-inflammatory', 'prescribed'
+)
+
+def _build_automaton(keywords: Tuple[str, ...]) -> ahocorasick.Automaton:
+    """Build an Aho-Corasick automaton matching all keywords in a single pass"""
+    automaton = ahocorasick.Automaton()
+    for kw in keywords:
+        automaton.add_word(kw, kw)
+    automaton.make_automaton()
+    return automaton
+
+# Keyword automata for rule-based extraction, built once per process
+_DX_AUTOMATON = _build_automaton(DIAGNOSIS_KEYWORDS)
+_TX_AUTOMATON = _build_automaton(TREATMENT_KEYWORDS)
+
+@lru_cache(maxsize=1024)
+def _match_keywords(text_lower: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Find diagnosis and treatment keywords, memoized for repeated transcripts"""
+    # One scan per automaton finds every (possibly overlapping) keyword
+    matched_dx = {kw for _, kw in _DX_AUTOMATON.iter(text_lower)}
+    matched_tx = {kw for _, kw in _TX_AUTOMATON.iter(text_lower)}
+
+    # Keep the keyword list order for stable output
+    found_diagnoses = tuple(kw for kw in DIAGNOSIS_KEYWORDS if kw in matched_dx)
+    found_treatments = tuple(kw for kw in TREATMENT_KEYWORDS if kw in matched_tx)
+    return found_diagnoses, found_treatments
+
 class BioBERTProcessor:
     def __init__(self):
         """Initialize BioBERT NER processor"""
+        self.tokenizer = None
+        self.model = None
+        self.ner_pipeline = None
+
+        # extract_entities only uses the rule-based path, so the ~440 MB model
+        # is only loaded when explicitly requested
+        if os.environ.get("ENABLE_BIOBERT", "0") != "1":
+            logger.info("BioBERT disabled (set ENABLE_BIOBERT=1 to load it), using rule-based extraction")
+            return
+
         try:
             model_name = "dmis-lab/biobert-v1.1"
             logger.info(f"Loading BioBERT model: {model_name}")
@@ -32,7 +86,7 @@ class BioBERTProcessor:
     
     def extract_entities(self, text: str) -> Dict[str, str]:
         """Extract medical entities from text using rule-based approach"""
-        print(f"Extracting entities from: {text[:100]}...")
+        logger.debug("Extracting entities from: %s...", text[:100])
         
         # Always use rule-based extraction to avoid numpy serialization issues
         return self._extract_with_rules(text)
@@ -68,31 +122,10 @@ class BioBERTProcessor:
     
     def _extract_with_rules(self, text: str) -> Dict[str, str]:
         """Rule-based entity extraction"""
-        text_lower = text.lower()
-        
-        # Common veterinary diagnosis keywords
-        diagnosis_keywords = [
-            'fever', 'anemia', 'infection', 'inflammation', 'arthritis',
-            'dermatitis', 'gastritis', 'pneumonia', 'diabetes', 'cancer',
-            'tumor', 'fracture', 'wound', 'allergy', 'parasites', 'fleas',
-            'ticks', 'worms', 'diarrhea', 'vomiting', 'seizure', 'lameness',
-            'lethargy', 'elevated temperature', 'temperature'
-        ]
-        
-        # Common treatment keywords
-        treatment_keywords = [
-            'antibiotic', 'antibiotics', 'doxycycline', 'amoxicillin',
-            'prednisone', 'surgery', 'vaccination', 'medication', 'treatment',
-            'therapy', 'rest', 'diet', 'exercise', 'bandage', 'cast',
-            'fluids', 'pain relief', 'anti-inflammatory', 'prescribed'
-        ]
-        
-        # Extract matching terms
-        found_diagnoses = [kw for kw in diagnosis_keywords if kw in text_lower]
-        found_treatments = [kw for kw in treatment_keywords if kw in text_lower]
+        found_diagnoses, found_treatments = _match_keywords(text.lower())
         
-        print(f"Found diagnoses: {found_diagnoses}")
-        print(f"Found treatments: {found_treatments}")
+        logger.debug("Found diagnoses: %s", list(found_diagnoses))
+        logger.debug("Found treatments: %s", list(found_treatments))
         
         return {
             'diagnosis': ', '.join(found_diagnoses),
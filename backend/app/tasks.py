@@ -0,0 +1,301 @@
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, Optional
+
+import soundfile as sf
+from celery import chain
+
+from .audio import VOSK_SAMPLE_RATE, ffmpeg_available, is_vosk_wav, load_mono_16k, mmap_wav_pcm, stream_convert_to_wav
+from .celery_app import celery_app
+from .transcription import get_transcriber
+from .ner_processor import BioBERTProcessor
+
+logger = logging.getLogger(__name__)
+
+# Only the most recent stages are kept in a task's progress record
+MAX_STAGES = 50
+
+# Processors are loaded once per transcribe worker process, never in the
+# API process or on decode workers
+transcriber = None
+ner_processor = None
+
+def init_processors():
+    global transcriber, ner_processor
+    # A transcriber without a model is retried, it may have been downloaded since
+    if transcriber is not None and transcriber.model_loaded:
+        return
+
+    logger.info("Initializing transcription and NER processors...")
+
+    try:
+        transcriber = get_transcriber()
+        if ner_processor is None:
+            ner_processor = BioBERTProcessor()
+        logger.info("Processors initialized successfully")
+    except Exception as e:
+        logger.error(f"Failed to initialize processors: {str(e)}")
+        raise
+
+def new_progress(task_id: str) -> Dict:
+    """Create an empty progress record for a task"""
+    now = datetime.now().isoformat()
+    return {
+        "task_id": task_id,
+        "stages": [],
+        "current_stage": "started",
+        "overall_progress": 0,
+        "status": "processing",
+        "start_time": now,
+        "last_update": now
+    }
+
+def update_progress(task, task_progress: Dict, stage: str, progress: int, message: str, details: Optional[Dict] = None):
+    """Update progress for a task and publish it to the result backend"""
+    task_progress["stages"].append({
+        "stage": stage,
+        "progress": progress,
+        "message": message,
+        "timestamp": datetime.now().isoformat(),
+        "details": details or {}
+    })
+    del task_progress["stages"][:-MAX_STAGES]
+
+    task_progress["current_stage"] = stage
+    task_progress["overall_progress"] = progress
+    task_progress["last_update"] = datetime.now().isoformat()
+    if stage == "error":
+        task_progress["status"] = "error"
+
+    # Both pipeline steps report under the id handed back to the client
+    task.update_state(task_id=task_progress["task_id"], state="PROGRESS", meta=task_progress)
+    logger.info(f"Task {task_progress['task_id']}: {stage} - {progress}% - {message}")
+
+def start_transcription(file_path: str) -> str:
+    """Queue the decode -> transcribe pipeline for an uploaded file.
+
+    Decoding and transcription are separate tasks on separate queues, so
+    decode workers can convert the next upload while the transcribe worker
+    is still running Vosk on the current one. Returns the task id used for
+    progress and results.
+    """
+    task_id = str(uuid.uuid4())
+    chain(
+        convert_audio.s(file_path, task_id),
+        transcribe_audio.s()
+    ).apply_async(task_id=task_id)
+    return task_id
+
+def converted_path_for(file_path: str) -> str:
+    """WAV path for Vosk next to the upload, whatever its extension"""
+    return os.path.splitext(file_path)[0] + '_converted.wav'
+
+def cleanup_files(file_path: str):
+    """Remove an upload, its converted WAV and the upload's temp directory"""
+    for path in (file_path, converted_path_for(file_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove temporary file {path}: {str(e)}")
+
+    # Uploads get a directory of their own; rmdir only succeeds once it is empty
+    try:
+        os.rmdir(os.path.dirname(file_path))
+    except OSError:
+        pass
+
+def _convert(task, task_progress: Dict, file_path: str) -> Optional[str]:
+    """Validate and convert the upload, returning the WAV path or None on error"""
+    task_id = task_progress["task_id"]
+
+    # Stage 1: File validation and preparation
+    update_progress(task, task_progress, "file_preparation", 10, "Validating uploaded audio file")
+
+    # One stat covers both existence and size
+    try:
+        file_size = os.stat(file_path).st_size
+    except FileNotFoundError:
+        update_progress(task, task_progress, "error", 0, "Audio file not found")
+        return None
+
+    update_progress(task, task_progress, "file_preparation", 20, f"Audio file validated ({file_size} bytes)")
+
+    # Stage 2: Audio conversion
+    update_progress(task, task_progress, "audio_conversion", 30, "Converting audio to WAV format")
+
+    try:
+        # Detect the actual file format and handle conversion properly
+        update_progress(task, task_progress, "audio_conversion", 35, "Detecting audio format and loading audio")
+
+        if file_size == 0:
+            error_msg = "Audio file is empty"
+            logger.error(f"Empty file for task {task_id}: {error_msg}")
+            update_progress(task, task_progress, "error", 0, error_msg)
+            return None
+
+        logger.info(f"File exists: {file_path}, size: {file_size} bytes")
+
+        # Uploads already in Vosk's native format skip the decode/re-encode round trip
+        try:
+            info = sf.info(file_path)
+        except Exception:
+            info = None
+
+        if is_vosk_wav(info):
+            converted_path = file_path
+            update_progress(task, task_progress, "audio_conversion", 60, "Input already 16kHz mono PCM_16, skipping conversion")
+        else:
+            converted_path = converted_path_for(file_path)
+
+            if ffmpeg_available():
+                # Stream decode + resample so the whole recording is never held in memory
+                try:
+                    logger.info(f"Streaming audio conversion with ffmpeg: {file_path}")
+                    n_samples = stream_convert_to_wav(file_path, converted_path)
+                    update_progress(task, task_progress, "audio_conversion", 50, "Audio converted successfully")
+                    update_progress(task, task_progress, "audio_conversion", 60, f"Sample rate: {VOSK_SAMPLE_RATE}Hz, Duration: {n_samples/VOSK_SAMPLE_RATE:.2f}s")
+                except Exception as convert_error:
+                    error_msg = f"Failed to convert audio file: {str(convert_error)}"
+                    logger.error(f"Audio conversion error for task {task_id}: {error_msg}")
+                    update_progress(task, task_progress, "error", 0, error_msg)
+                    return None
+            else:
+                # Decode and resample in-process (librosa only for codecs libsndfile can't read)
+                try:
+                    logger.info(f"Attempting to load audio file: {file_path}")
+                    audio_data = load_mono_16k(file_path)
+                    sample_rate = VOSK_SAMPLE_RATE
+                    update_progress(task, task_progress, "audio_conversion", 40, f"Audio loaded: {sample_rate}Hz, {len(audio_data)/sample_rate:.2f}s")
+                except Exception as load_error:
+                    error_msg = f"Failed to load audio file: {str(load_error)}"
+                    logger.error(f"Audio loading error for task {task_id}: {error_msg}")
+                    update_progress(task, task_progress, "error", 0, error_msg)
+                    return None
+
+                try:
+                    sf.write(converted_path, audio_data, sample_rate, subtype='PCM_16')
+                    update_progress(task, task_progress, "audio_conversion", 50, "Audio converted successfully")
+                    update_progress(task, task_progress, "audio_conversion", 60, f"Sample rate: {sample_rate}Hz, Duration: {len(audio_data)/sample_rate:.2f}s")
+                except Exception as write_error:
+                    error_msg = f"Failed to save converted audio: {str(write_error)}"
+                    logger.error(f"Audio write error for task {task_id}: {error_msg}")
+                    update_progress(task, task_progress, "error", 0, error_msg)
+                    return None
+
+    except Exception as e:
+        error_msg = f"Audio conversion failed: {str(e)}"
+        logger.error(f"Audio conversion error for task {task_id}: {error_msg}")
+        update_progress(task, task_progress, "error", 0, error_msg)
+        return None
+
+    return converted_path
+
+@celery_app.task(bind=True)
+def convert_audio(self, file_path: str, task_id: str) -> Dict:
+    """Pipeline step 1: validate the upload and convert it to 16kHz mono WAV"""
+    task_progress = new_progress(task_id)
+    converted_path = None
+
+    try:
+        update_progress(self, task_progress, "started", 0, "Task picked up by worker")
+        converted_path = _convert(self, task_progress, file_path)
+    except Exception as e:
+        logger.error(f"Task {task_id} failed: {str(e)}")
+        update_progress(self, task_progress, "error", 0, f"Processing failed: {str(e)}")
+    finally:
+        # Nothing downstream needs the files once decoding has failed
+        if task_progress["status"] == "error":
+            cleanup_files(file_path)
+
+    return {
+        "progress": task_progress,
+        "file_path": file_path,
+        "converted_path": converted_path
+    }
+
+@celery_app.task(bind=True)
+def transcribe_audio(self, conversion: Dict) -> Dict:
+    """Pipeline step 2: transcribe the converted audio and extract entities"""
+    task_id = self.request.id
+    task_progress = conversion["progress"]
+    file_path = conversion["file_path"]
+    converted_path = conversion["converted_path"]
+
+    try:
+        if task_progress["status"] == "error":
+            return task_progress
+
+        # Stage 3: Vosk model loading check
+        update_progress(self, task_progress, "model_loading", 70, "Checking Vosk transcription model")
+
+        # Loaded on first use so only transcribe workers pay for the models
+        init_processors()
+
+        if transcriber is None or not transcriber.model_loaded:
+            update_progress(self, task_progress, "error", 0, "Vosk model not loaded")
+            return task_progress
+
+        update_progress(self, task_progress, "model_loading", 80, "Vosk model ready for transcription")
+
+        # Stage 4: Transcription
+        update_progress(self, task_progress, "transcription", 85, "Starting speech-to-text transcription")
+
+        try:
+            # The decode step always leaves 16kHz mono PCM_16, so its samples go to
+            # Vosk directly instead of through transcribe()'s format checks
+            with mmap_wav_pcm(converted_path) as pcm:
+                transcript = transcriber.transcribe_pcm(pcm)
+            if not transcript or transcript.strip() == "":
+                update_progress(self, task_progress, "error", 0, "Transcription failed - no speech detected")
+                return task_progress
+
+            update_progress(self, task_progress, "transcription", 90, f"Transcription completed: {len(transcript)} characters")
+            update_progress(self, task_progress, "transcription", 95, f"Transcript preview: {transcript[:100]}...")
+
+        except Exception as e:
+            error_msg = f"Transcription failed: {str(e)}"
+            logger.error(f"Transcription error for task {task_id}: {error_msg}")
+            update_progress(self, task_progress, "error", 0, error_msg)
+            return task_progress
+
+        # Stage 5: NER processing
+        update_progress(self, task_progress, "ner_processing", 96, "Extracting medical entities")
+
+        try:
+            entities = ner_processor.extract_entities(transcript)
+            update_progress(self, task_progress, "ner_processing", 98, f"Found {len(entities)} medical entities")
+
+        except Exception as e:
+            update_progress(self, task_progress, "error", 0, f"NER processing failed: {str(e)}")
+            return task_progress
+
+        # Stage 6: Final processing
+        update_progress(self, task_progress, "final_processing", 99, "Generating final results")
+
+        # Generate diagnosis and treatment suggestions
+        diagnosis = "Based on the transcription, please consult with a veterinarian for proper diagnosis."
+        treatment = "Treatment recommendations should be provided by a qualified veterinarian."
+
+        # Store final results
+        task_progress["results"] = {
+            "transcript": transcript,
+            "diagnosis": diagnosis,
+            "treatment": treatment,
+            "entities": entities
+        }
+
+        task_progress["status"] = "completed"
+        update_progress(self, task_progress, "completed", 100, "Processing completed successfully")
+
+    except Exception as e:
+        logger.error(f"Task {task_id} failed: {str(e)}")
+        update_progress(self, task_progress, "error", 0, f"Processing failed: {str(e)}")
+    finally:
+        # Runs on every exit path so failed transcriptions don't leak temp files
+        cleanup_files(file_path)
+
+    return task_progress
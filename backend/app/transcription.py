@@ -1,353 +1,572 @@
+import argparse
+import asyncio
+import copy
+import hashlib
 import logging
-import wave
 import vosk
 import os
-import json
-import librosa
+import orjson
+import numpy as np
+import requests
 import soundfile as sf
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Literal, Optional
+
+from .audio import VOSK_SAMPLE_RATE, is_vosk_wav, load_mono_16k
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
 
 logger = logging.getLogger(__name__)
 
+# The small model (~40 MB) decodes several times faster in a fraction of
+# the memory; the large one (~1.8 GB) is more accurate on difficult audio
+VOSK_MODELS = {
+    "small": "vosk-model-small-en-us-0.15",
+    "large": "vosk-model-en-us-0.22",
+}
+VOSK_MODEL_URL = "https://alphacephei.com/vosk/models/{name}.zip"
+MODELS_DIR = os.path.join(os.path.dirname(__file__), "..", "models")
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Model archives up to this size are extracted without touching disk
+SPOOL_MAX_SIZE = 512 * 1024 * 1024
+
+# WebRTC VAD classifies 30 ms frames at 16kHz
+VAD_FRAME_SAMPLES = 16000 * 30 // 1000
+# 0 (least) to 3 (most aggressive) at discarding non-speech
+VAD_AGGRESSIVENESS = 2
+# Silence appended after each speech run so words at its edges stay separate
+VAD_PAD = bytes(2 * 16000 // 10)
+# Frames kept from before each speech onset (300 ms), VAD fires late on soft
+# word starts
+VAD_PREROLL_FRAMES = 10
+# Streamed WAV blocks hold a whole number of VAD frames (~2 s)
+WAV_BLOCK_SAMPLES = VAD_FRAME_SAMPLES * 67
+
+# Shared by every transcribe_async caller in the process; AcceptWaveform
+# releases the GIL, so these threads decode in parallel. Created on first
+# use, so importing this module (Celery workers, the API) starts no threads
+_decode_executor: Optional[ThreadPoolExecutor] = None
+_decode_executor_lock = threading.Lock()
+
+def _get_decode_executor() -> ThreadPoolExecutor:
+    global _decode_executor
+    with _decode_executor_lock:
+        if _decode_executor is None:
+            _decode_executor = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="vosk-decode")
+        return _decode_executor
+
+def _f32_to_i16(samples: np.ndarray) -> np.ndarray:
+    """Convert float samples in [-1, 1] to int16, clipping and scaling in place"""
+    np.clip(samples, -1.0, 1.0, out=samples)
+    np.multiply(samples, 32767, out=samples)
+    return np.rint(samples, out=samples).astype(np.int16)
+
 class VoskTranscriber:
-    def __init__(self, model_path: str = None):
+    def __init__(self, model_path: str = None, model_size: Optional[Literal["small", "large"]] = None):
         """Initialize Vosk transcriber with model"""
+        # Per-thread copies with their own recognizer, see _thread_session
+        self._local = threading.local()
+        
         try:
+            if model_size is None:
+                model_size = os.environ.get("VOSK_MODEL_SIZE", "small")
+            if model_size not in VOSK_MODELS:
+                raise ValueError(f"Unknown Vosk model size: {model_size}")
+            self.model_name = VOSK_MODELS[model_size]
+            
             if model_path is None:
-                model_path = os.path.join(os.path.dirname(__file__), "..", "models", "vosk-model-en-us-0.22")
+                model_path = os.path.join(MODELS_DIR, self.model_name)
             
             self.model_path = Path(model_path)
-            self._download_model_if_needed()
+            # Never download from here, a cold cache would stall the first request
+            if not self.model_path.exists():
+                raise FileNotFoundError(
+                    f"Vosk model not found at {self.model_path}, "
+                    f"run `python -m app.transcription download-model --size {model_size}`"
+                )
             
             logger.info(f"Loading Vosk model from {self.model_path}")
             self.model = vosk.Model(str(self.model_path))
-            # Initialize recognizer with 16kHz sample rate (Vosk requirement)
-            self.recognizer = vosk.KaldiRecognizer(self.model, 16000)
+            self.recognizer = self._new_recognizer()
             self.model_loaded = True
             logger.info("Vosk model loaded successfully")
             
+            # Opt-in silence gating, so Kaldi only runs over speech
+            self.vad = None
+            if os.environ.get("ENABLE_VAD", "0") == "1":
+                if webrtcvad is None:
+                    logger.warning("ENABLE_VAD is set but webrtcvad is not installed, decoding everything")
+                else:
+                    self.vad = webrtcvad.Vad(VAD_AGGRESSIVENESS)
+            
         except Exception as e:
             logger.error(f"Failed to load Vosk model: {str(e)}")
             self.model_loaded = False
             self.model = None
             self.recognizer = None
+            self.vad = None
         
-    def _download_model_if_needed(self):
-        """Download Vosk model if not present"""
-        if not self.model_path.exists():
-            logger.info("Vosk model not found, downloading...")
-            os.makedirs(self.model_path.parent, exist_ok=True)
-            
-            # Download and extract model
-            import urllib.request
-            import zipfile
-            
-            model_url = "https://alphacephei.com/vosk/models/vosk-model-en-us-0.22.zip"
-            zip_path = self.model_path.parent / "model.zip"
-            
-            logger.info("Downloading Vosk model (this may take a few minutes)...")
-            urllib.request.urlretrieve(model_url, zip_path)
-            
-            logger.info("Extracting model...")
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(self.model_path.parent)
-            
-            # Remove zip file
-            os.remove(zip_path)
-            logger.info("Model download completed")
-
+    def _new_recognizer(self):
+        """Create a recognizer on the loaded model"""
+        # Initialize recognizer with 16kHz sample rate (Vosk requirement)
+        recognizer = vosk.KaldiRecognizer(self.model, 16000)
+        # Only the text is used, skip word-level alignment in the results
+        recognizer.SetWords(False)
+        return recognizer
+    
     def transcribe(self, audio_path: str) -> str:
-        """Transcribe audio file to text - REAL TRANSCRIPTION ONLY"""
-        print(f"🔄 Starting REAL transcription for: {audio_path}")
+        """Transcribe audio file to text"""
+        logger.debug("Starting transcription for: %s", audio_path)
         
         # Check if model is loaded
         if not self.model_loaded:
-            print("❌ Vosk model not loaded")
+            logger.error("Vosk model not loaded")
             return "Error: Speech recognition model not available. Please restart the server."
         
-        # First, try to get file info
+        # One stat covers both existence and size
         try:
-            import os
-            file_size = os.path.getsize(audio_path)
-            print(f"📁 Input file size: {file_size} bytes")
+            file_size = os.stat(audio_path).st_size
+            logger.debug("Input file size: %d bytes", file_size)
             
             if file_size < 100:
                 raise Exception("Audio file too small or corrupted")
                 
         except Exception as e:
-            print(f"❌ File check failed: {str(e)}")
+            logger.error("File check failed: %s", e)
             return f"Error: Could not read audio file - {str(e)}"
         
-        # Try real transcription methods
-        transcription_methods = [
-            self._transcribe_real_audio,
-            self._transcribe_fallback
-        ]
-        
-        for i, method in enumerate(transcription_methods):
+        try:
             try:
-                print(f"🔧 Trying transcription method {i+1}")
-                result = method(audio_path)
-                if result and result.strip() and not result.startswith("Error:"):
-                    print(f"✅ Transcription successful with method {i+1}")
-                    return result
-            except Exception as e:
-                print(f"❌ Transcription method {i+1} failed: {str(e)}")
-                continue
+                info = sf.info(audio_path)
+            except Exception:
+                info = None
+            
+            # Uploads already in Vosk's format are streamed from disk, anything
+            # else is decoded and resampled in memory
+            if is_vosk_wav(info):
+                result = self._process_wav_file(audio_path, info)
+            else:
+                result = self.transcribe_pcm(self._bytes_for_vosk(audio_path))
+        except Exception as e:
+            logger.error("Transcription failed for %s: %s", audio_path, e, exc_info=True)
+            result = ""
         
-        return "Transcription failed. Please try a different audio file or speak more clearly."
+        if not result.strip():
+            return "Transcription failed. Please try a different audio file or speak more clearly."
+        
+        logger.debug("Transcription successful: %r", result[:100])
+        return result
     
-    def _transcribe_real_audio(self, audio_path: str) -> str:
-        """Real transcription using Vosk with enhanced debugging"""
-        print(f"🎯 Starting REAL transcription with Vosk for: {audio_path}")
-        print(f"📊 Model loaded status: {self.model_loaded}")
+    def _process_wav_file(self, wav_path: str, info=None) -> str:
+        """Process WAV file with Vosk one block at a time"""
+        logger.debug("Processing WAV file with Vosk: %s", wav_path)
         
         try:
-            # Step 1: Convert audio to proper format
-            print("🔄 Step 1: Converting audio to WAV format...")
-            wav_path = self._convert_to_wav(audio_path)
-            print(f"✅ Audio converted to: {wav_path}")
-            
-            # Step 2: Get audio info
-            print("🔄 Step 2: Getting audio information...")
-            import soundfile as sf
-            audio_info = sf.info(wav_path)
-            print(f"📊 Audio info - Channels: {audio_info.channels}, Sample Rate: {audio_info.samplerate}, Duration: {audio_info.duration:.2f}s")
-            
-            # Step 3: Process with Vosk
-            print("🔄 Step 3: Processing with Vosk...")
-            result = self._process_wav_file(wav_path)
-            print(f"🎤 Vosk result: '{result}'")
+            # Drop any state left over from an earlier or aborted decode
+            self.recognizer.Reset()
+            
+            # Header only, the samples are streamed below; callers that
+            # already sniffed the format pass its info in
+            if info is None:
+                info = sf.info(wav_path)
+            logger.debug(
+                "WAV file details: channels=%d, sample rate=%d Hz, subtype=%s, frames=%d, duration=%.2fs",
+                info.channels, info.samplerate, info.subtype, info.frames, info.duration
+            )
+            
+            # Verify format
+            if info.channels != 1:
+                logger.warning("Audio is not mono: %s", wav_path)
+            if info.samplerate != 16000:
+                logger.warning("Sample rate is not 16kHz: %s", wav_path)
+            if info.subtype != 'PCM_16':
+                logger.warning("Sample width is not 16-bit: %s", wav_path)
+            
+            if info.frames == 0:
+                raise Exception("No audio data found")
             
-            # Step 4: Clean up
-            print("🔄 Step 4: Cleaning up temporary files...")
-            if os.path.exists(wav_path) and wav_path != audio_path:
-                os.unlink(wav_path)
-                print(f"🗑️ Cleaned up: {wav_path}")
+            # Process with Vosk following official documentation
+            logger.debug("Starting Vosk recognition")
             
-            if result and result.strip():
-                print(f"✅ Transcription successful: '{result[:100]}...'")
-                return result
-            else:
-                print("❌ Vosk returned empty result")
-                raise Exception("Vosk returned empty transcription")
+            # 2 s blocks keep memory flat however long the recording is
+            blocks = sf.blocks(wav_path, blocksize=WAV_BLOCK_SAMPLES, dtype='int16', always_2d=False)
+            text_parts = self._feed(self._speech_only(blocks))
+            return self._final_text(text_parts)
                 
         except Exception as e:
-            print(f"❌ Real transcription failed: {str(e)}")
-            print(f"🔍 Error type: {type(e).__name__}")
-            import traceback
-            print(f"📋 Full traceback: {traceback.format_exc()}")
-            raise
+            logger.debug("WAV processing failed: %s", e, exc_info=True)
+            raise Exception(f"WAV processing failed: {str(e)}")
     
-    def _process_wav_file(self, wav_path: str) -> str:
-        """Process WAV file with Vosk and detailed debugging"""
-        print(f"🎤 Processing WAV file with Vosk: {wav_path}")
+    def transcribe_pcm(self, pcm) -> str:
+        """Transcribe raw 16kHz mono 16-bit PCM (any bytes-like object) without any file round trip.
+        
+        The audio reaches Vosk in bounded bytes chunks, one copy each, so a
+        mapped WAV's pages are read but never duplicated whole in memory.
+        """
+        if not self.model_loaded:
+            raise RuntimeError("Speech recognition model not available")
+        
+        if len(pcm) == 0:
+            raise ValueError("No audio data found")
+        
+        logger.debug("Processing %d bytes of PCM with Vosk", len(pcm))
+        view = memoryview(pcm).cast('B')
+        samples = None
+        if self.vad is not None:
+            # Frames are classified straight from the caller's buffer
+            samples = np.frombuffer(view, dtype=np.int16)
+            chunks = self._speech_only(samples[i:i + WAV_BLOCK_SAMPLES] for i in range(0, len(samples), WAV_BLOCK_SAMPLES))
+        else:
+            # Vosk's cffi binding only takes bytes, so each ~2 s slice is copied
+            # once; a mapped WAV is never copied whole
+            step = WAV_BLOCK_SAMPLES * 2
+            chunks = (bytes(view[i:i + step]) for i in range(0, len(view), step))
         
         try:
-            import wave
-            with wave.open(wav_path, 'rb') as wf:
-                print(f"📊 WAV file details:")
-                print(f"   - Channels: {wf.getnchannels()}")
-                print(f"   - Sample rate: {wf.getframerate()} Hz")
-                print(f"   - Sample width: {wf.getsampwidth()} bytes")
-                print(f"   - Frames: {wf.getnframes()}")
-                print(f"   - Duration: {wf.getnframes() / wf.getframerate():.2f} seconds")
-                
-                # Verify format
-                if wf.getnchannels() != 1:
-                    print("⚠️ Warning: Audio is not mono")
-                if wf.getframerate() != 16000:
-                    print("⚠️ Warning: Sample rate is not 16kHz")
-                if wf.getsampwidth() != 2:
-                    print("⚠️ Warning: Sample width is not 16-bit")
-            
-            # Process with Vosk following official documentation
-            print("🔄 Starting Vosk recognition...")
-            
-            # Read audio data
-            with wave.open(wav_path, 'rb') as wf:
-                audio_data = wf.readframes(wf.getnframes())
-            
-            print(f"📊 Audio data size: {len(audio_data)} bytes")
-            
-            if len(audio_data) == 0:
-                raise Exception("No audio data found")
-            
-            # Process audio in chunks (Vosk best practice)
-            chunk_size = 4000  # Process in 4KB chunks
-            text_parts = []
-            
-            for i in range(0, len(audio_data), chunk_size):
-                chunk = audio_data[i:i + chunk_size]
-                if self.recognizer.AcceptWaveform(chunk):
-                    result = self.recognizer.Result()
-                    if result:
-                        try:
-                            result_json = json.loads(result)
-                            chunk_text = result_json.get('text', '').strip()
-                            if chunk_text:
-                                text_parts.append(chunk_text)
-                        except json.JSONDecodeError:
-                            pass
-            
-            # Get final result
-            final_result = self.recognizer.FinalResult()
-            print(f"🎤 Final Vosk result: '{final_result}'")
-            
-            # Parse final result
-            try:
-                result_json = json.loads(final_result)
-                final_text = result_json.get('text', '').strip()
-                print(f"📝 Final parsed text: '{final_text}'")
-                
-                # Combine all text parts
-                all_text = ' '.join(text_parts + [final_text]).strip()
-                
-                if not all_text:
-                    print("⚠️ Warning: Vosk returned empty text")
-                    # Try partial results as fallback
-                    partial = self.recognizer.PartialResult()
-                    print(f"🔄 Partial result: '{partial}'")
+            self.recognizer.Reset()
+            text_parts = self._feed(chunks)
+            return self._final_text(text_parts)
+        finally:
+            # Drop every view of the caller's buffer, even on error, so a
+            # mapped WAV can be unmapped as soon as its with block ends
+            chunks.close()
+            del samples
+            view.release()
+    
+    def transcribe_threadsafe(self, pcm: bytes) -> str:
+        """Like transcribe_pcm, but safe to call from several threads at once"""
+        if not self.model_loaded:
+            raise RuntimeError("Speech recognition model not available")
+        
+        return self._thread_session().transcribe_pcm(pcm)
+    
+    async def transcribe_async(self, audio_path: str) -> str:
+        """Transcribe a file on the shared decode threads without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_decode_executor(), self._transcribe_on_thread, audio_path)
+    
+    def _transcribe_on_thread(self, audio_path: str) -> str:
+        """Run transcribe() on the calling thread's own recognizer"""
+        if not self.model_loaded:
+            return self.transcribe(audio_path)
+        
+        return self._thread_session().transcribe(audio_path)
+    
+    def _thread_session(self) -> "VoskTranscriber":
+        """This thread's copy of the transcriber, created on first use.
+        
+        KaldiRecognizer (and the VAD) keep per-utterance state and are not
+        reentrant, while the loaded Model is read-only. Each thread gets a
+        shallow copy with a recognizer of its own against the shared model.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = copy.copy(self)
+            session.recognizer = self._new_recognizer()
+            if self.vad is not None:
+                session.vad = webrtcvad.Vad(VAD_AGGRESSIVENESS)
+            self._local.session = session
+        return session
+    
+    def _speech_only(self, blocks: Iterable[np.ndarray]) -> Iterator[bytes]:
+        """Yield the speech in consecutive int16 blocks, one chunk per block.
+        
+        Non-speech 30 ms frames are dropped. Each speech run starts with the
+        frames just before its onset and ends with a short silence pad, and
+        runs carry over from one block to the next.
+        """
+        if self.vad is None:
+            for block in blocks:
+                yield block.tobytes()
+            return
+        
+        frame_bytes = VAD_FRAME_SAMPLES * 2
+        preroll = deque(maxlen=VAD_PREROLL_FRAMES)
+        in_speech = False
+        for block in blocks:
+            view = memoryview(block).cast('B')
+            pieces = []
+            # A trailing partial frame is too short to classify and is dropped
+            for start in range(0, len(view) - frame_bytes + 1, frame_bytes):
+                # Zero-copy view, the join below is the one copy of kept audio
+                frame = view[start:start + frame_bytes]
+                if self.vad.is_speech(frame, 16000):
+                    if not in_speech:
+                        pieces.extend(preroll)
+                        preroll.clear()
+                    pieces.append(frame)
+                    in_speech = True
+                else:
+                    if in_speech:
+                        pieces.append(VAD_PAD)
+                        in_speech = False
+                    preroll.append(frame)
+            
+            # Vosk's cffi binding only takes bytes
+            if pieces:
+                yield b"".join(pieces)
+        
+        if in_speech:
+            yield VAD_PAD
+    
+    def _feed(self, chunks: Iterable[bytes]) -> List[str]:
+        """Feed PCM chunks in order, returning the text of each finished utterance"""
+        text_parts = []
+        
+        for chunk in chunks:
+            if self.recognizer.AcceptWaveform(chunk):
+                result = self.recognizer.Result()
+                if result:
                     try:
-                        partial_json = json.loads(partial)
-                        all_text = partial_json.get('partial', '').strip()
-                    except json.JSONDecodeError:
+                        result_json = orjson.loads(result)
+                        chunk_text = result_json.get('text', '').strip()
+                        if chunk_text:
+                            text_parts.append(chunk_text)
+                    except orjson.JSONDecodeError:
                         pass
-                
-                return all_text
-                
-            except json.JSONDecodeError as e:
-                print(f"❌ Failed to parse Vosk JSON result: {e}")
-                print(f"🔍 Raw result was: {final_result}")
-                return final_result.strip()
-                
-        except Exception as e:
-            print(f"❌ WAV processing failed: {str(e)}")
-            import traceback
-            print(f"📋 Full traceback: {traceback.format_exc()}")
-            raise Exception(f"WAV processing failed: {str(e)}")
+        
+        return text_parts
     
-    def _transcribe_fallback(self, audio_path: str) -> str:
-        """Fallback transcription method with simpler conversion"""
+    def _final_text(self, text_parts: List[str]) -> str:
+        """Flush the recognizer and join its final text onto the earlier parts"""
+        # Get final result
+        final_result = self.recognizer.FinalResult()
+        logger.debug("Final Vosk result: %s", final_result)
+        
+        # Parse final result
         try:
-            print("Using fallback transcription method...")
-            
-            # Try to load audio with different parameters
-            audio_data, sr = librosa.load(audio_path, sr=16000, mono=True, res_type='kaiser_fast')
-            
-            if len(audio_data) == 0:
-                raise ValueError("Empty audio data")
-            
-            print(f"Fallback audio loaded: {len(audio_data)} samples, {sr} Hz")
-            
-            # Create WAV file with wave module directly
-            import tempfile
-            import wave
-            import numpy as np
-            
-            temp_wav = tempfile.mktemp(suffix='.wav')
-            
-            # Convert to 16-bit PCM
-            audio_int16 = (audio_data * 32767).astype(np.int16)
-            
-            # Write WAV file manually
-            with wave.open(temp_wav, 'wb') as wav_file:
-                wav_file.setnchannels(1)  # Mono
-                wav_file.setsampwidth(2)  # 16-bit
-                wav_file.setframerate(16000)  # 16kHz
-                wav_file.writeframes(audio_int16.tobytes())
-            
-            print(f"Fallback WAV file created: {temp_wav}")
-            
-            # Process with Vosk
-            return self._process_wav_file(temp_wav)
-            
-        except Exception as e:
-            print(f"Fallback transcription failed: {str(e)}")
-            raise Exception(f"Fallback conversion failed: {str(e)}")
-
-    def _convert_to_wav(self, audio_path: str) -> str:
-        """Convert audio to WAV format with detailed debugging"""
-        print(f"🔄 Converting audio file: {audio_path}")
+            result_json = orjson.loads(final_result)
+            final_text = result_json.get('text', '').strip()
+            logger.debug("Final parsed text: %r", final_text)
+            
+            # Combine all text parts
+            all_text = ' '.join(text_parts + [final_text]).strip()
+            
+            if not all_text:
+                logger.debug("Vosk returned empty text")
+                # Try partial results as fallback
+                partial = self.recognizer.PartialResult()
+                logger.debug("Partial result: %s", partial)
+                try:
+                    partial_json = orjson.loads(partial)
+                    all_text = partial_json.get('partial', '').strip()
+                except orjson.JSONDecodeError:
+                    pass
+            
+            return all_text
+            
+        except orjson.JSONDecodeError as e:
+            logger.warning("Failed to parse Vosk JSON result: %s (raw result: %s)", e, final_result)
+            return final_result.strip()
+    
+    def _bytes_for_vosk(self, audio_path: str) -> bytes:
+        """Load audio as the raw 16kHz mono 16-bit PCM that Vosk accepts"""
+        logger.debug("Loading audio file: %s", audio_path)
         
         try:
-            # Check if it's already a WAV file
-            if audio_path.lower().endswith('.wav'):
-                print("✅ File is already WAV format")
-                return audio_path
-            
-            print("🔄 Loading audio with librosa...")
-            # Load audio with specific parameters for Vosk
-            audio_data, sr = librosa.load(audio_path, sr=16000, mono=True, res_type='kaiser_fast')
-            print(f"📊 Loaded audio: {len(audio_data)} samples, {sr} Hz")
+            logger.debug("Decoding and resampling audio")
+            audio_data = load_mono_16k(audio_path)
+            logger.debug("Loaded audio: %d samples, %d Hz", len(audio_data), VOSK_SAMPLE_RATE)
             
             if len(audio_data) == 0:
                 raise Exception("Empty audio data after loading")
             
-            # Create temporary WAV file
-            import tempfile
-            temp_wav = tempfile.mktemp(suffix='.wav')
-            print(f"🔄 Creating temporary WAV file: {temp_wav}")
-            
-            # Write WAV file with Vosk-compatible format: 16kHz, 16-bit, mono
-            print("🔄 Writing WAV file with soundfile...")
-            sf.write(temp_wav, audio_data, 16000, subtype='PCM_16', format='WAV')
-            print(f"✅ WAV file created successfully")
-            
-            # Verify the WAV file
-            print("🔄 Verifying WAV file format...")
-            import wave
-            with wave.open(temp_wav, 'rb') as wf:
-                channels = wf.getnchannels()
-                framerate = wf.getframerate()
-                sampwidth = wf.getsampwidth()
-                frames = wf.getnframes()
-                
-                print(f"📊 WAV verification:")
-                print(f"   - Channels: {channels} (expected: 1)")
-                print(f"   - Sample rate: {framerate} Hz (expected: 16000)")
-                print(f"   - Sample width: {sampwidth} bytes (expected: 2)")
-                print(f"   - Frames: {frames}")
-                print(f"   - Duration: {frames / framerate:.2f} seconds")
-                
-                if channels != 1 or framerate != 16000 or sampwidth != 2:
-                    print("⚠️ Warning: WAV format doesn't match Vosk requirements")
-                    # Try to fix the format
-                    print("🔄 Attempting to fix WAV format...")
-                    return self._fix_wav_format(temp_wav, audio_data)
-                else:
-                    print("✅ WAV format is correct for Vosk")
-            
-            return temp_wav
+            return _f32_to_i16(audio_data).tobytes()
             
         except Exception as e:
-            print(f"❌ Audio conversion failed: {str(e)}")
-            import traceback
-            print(f"📋 Full traceback: {traceback.format_exc()}")
-            raise Exception(f"Audio conversion failed: {str(e)}")
+            logger.debug("Audio loading failed: %s", e, exc_info=True)
+            raise Exception(f"Audio loading failed: {str(e)}")
+
+class VoskStreamingTranscriber:
+    """Incremental transcription of live 16kHz mono 16-bit PCM.
     
-    def _fix_wav_format(self, wav_path: str, audio_data) -> str:
-        """Fix WAV format to match Vosk requirements"""
-        try:
-            import tempfile
-            import wave
-            import numpy as np
-            
-            # Create new WAV file with correct format
-            fixed_wav = tempfile.mktemp(suffix='.wav')
-            
-            # Ensure audio data is in correct range and format
-            audio_int16 = (audio_data * 32767).astype(np.int16)
-            
-            with wave.open(fixed_wav, 'wb') as wav_file:
-                wav_file.setnchannels(1)  # Mono
-                wav_file.setsampwidth(2)  # 16-bit
-                wav_file.setframerate(16000)  # 16kHz
-                wav_file.writeframes(audio_int16.tobytes())
-            
-            print(f"✅ Fixed WAV file created: {fixed_wav}")
-            return fixed_wav
-            
-        except Exception as e:
-            print(f"❌ Failed to fix WAV format: {str(e)}")
-            return wav_path  # Return original if fixing fails
\ No newline at end of file
+    Vosk's partial hypothesis for an utterance can still change as audio
+    arrives, so words are only committed once two consecutive partials
+    agree on them (the LocalAgreement-2 policy from Whisper-Streaming).
+    Audio since the last utterance endpoint is kept in a buffer; when it
+    outgrows buffer_seconds, the audio up to the end of the last committed
+    word is dropped and the recognizer re-decodes only the uncommitted tail.
+    """
+    
+    def __init__(self, transcriber: VoskTranscriber, chunk_seconds: float = 1.0, buffer_seconds: float = 30.0):
+        """Create a streaming recognizer on an already loaded transcriber's model"""
+        if not transcriber.model_loaded:
+            raise RuntimeError("Speech recognition model not available")
+        
+        self.recognizer = vosk.KaldiRecognizer(transcriber.model, 16000)
+        # Word times in results and partials tell us where committed audio stops
+        self.recognizer.SetWords(True)
+        self.recognizer.SetPartialWords(True)
+        self.chunk_bytes = int(chunk_seconds * 16000) * 2
+        self.buffer_bytes = int(buffer_seconds * 16000) * 2
+        self.samples_fed = 0
+        self._start_utterance()
+    
+    def stream_transcribe(self, audio_iter: Iterable[bytes]) -> Iterator[str]:
+        """Yield newly committed text as it becomes stable, then the final words"""
+        pending = bytearray()
+        for data in audio_iter:
+            pending += data
+            while len(pending) >= self.chunk_bytes:
+                chunk = bytes(pending[:self.chunk_bytes])
+                del pending[:self.chunk_bytes]
+                words = self._process_chunk(chunk)
+                if words:
+                    yield " ".join(words)
+        
+        words = self._process_chunk(bytes(pending)) if pending else []
+        words += self._finish_utterance()
+        if words:
+            yield " ".join(words)
+    
+    def _start_utterance(self):
+        """Reset the recognizer and start an empty buffer at the current recognizer time.
+        
+        Reset() does not restart Vosk's word timestamps, they keep counting
+        every sample fed so far, so buffer_start records the time of buffer[0].
+        """
+        self.recognizer.Reset()
+        self.buffer = bytearray()
+        self.buffer_start = self.samples_fed / 16000
+        self.committed: List[Dict] = []
+        self.previous: List[Dict] = []
+    
+    def _process_chunk(self, chunk: bytes) -> List[str]:
+        """Feed one chunk, returning the words it commits"""
+        self.buffer += chunk
+        words = self._accept(chunk)
+        if len(self.buffer) > self.buffer_bytes:
+            words += self._trim()
+        return words
+    
+    def _accept(self, chunk: bytes) -> List[str]:
+        """Feed audio already in the buffer to the recognizer, returning newly committed words"""
+        self.samples_fed += len(chunk) // 2
+        if self.recognizer.AcceptWaveform(chunk):
+            # Endpoint: the utterance's final result supersedes its partials
+            words = orjson.loads(self.recognizer.Result()).get("result", [])
+            new_words = [word["word"] for word in self._uncommitted(words)]
+            # Audio after the last recognized word may already hold the next utterance
+            cut = self._buffer_offset(words[-1]["end"]) if words else len(self.buffer)
+            tail = bytes(self.buffer[cut:]) if cut > 0 else b""
+            self._start_utterance()
+            if tail:
+                self.buffer += tail
+                new_words += self._accept(tail)
+            return new_words
+        
+        partial = orjson.loads(self.recognizer.PartialResult()).get("partial_result", [])
+        agreed = 0
+        for previous, current in zip(self.previous, partial):
+            if previous["word"] != current["word"]:
+                break
+            agreed += 1
+        
+        new_words = partial[len(self.committed):agreed]
+        self.committed.extend(new_words)
+        self.previous = partial
+        return [word["word"] for word in new_words]
+    
+    def _trim(self) -> List[str]:
+        """Bound the buffer by re-decoding only the audio after the last committed word"""
+        if not self.committed:
+            # Nothing stable to cut at, close the utterance here instead
+            return self._finish_utterance()
+        
+        cut = self._buffer_offset(self.committed[-1]["end"])
+        tail = bytes(self.buffer[cut:])
+        self._start_utterance()
+        self.buffer += tail
+        return self._accept(tail)
+    
+    def _finish_utterance(self) -> List[str]:
+        """Flush the recognizer and return the utterance's uncommitted words"""
+        words = orjson.loads(self.recognizer.FinalResult()).get("result", [])
+        new_words = [word["word"] for word in self._uncommitted(words)]
+        self._start_utterance()
+        return new_words
+    
+    def _buffer_offset(self, seconds: float) -> int:
+        """Byte offset into the buffer of a recognizer timestamp"""
+        samples = int(round((seconds - self.buffer_start) * 16000))
+        return min(len(self.buffer), max(0, samples) * 2)
+    
+    def _uncommitted(self, words: List[Dict]) -> List[Dict]:
+        """Words of a final result that lie after the last committed word"""
+        if not self.committed:
+            return words
+        # Match on timing, the final hypothesis may split or merge committed words
+        last_end = self.committed[-1]["end"]
+        return [word for word in words if (word["start"] + word["end"]) / 2 > last_end]
+
+@lru_cache(maxsize=1)
+def _load_transcriber(model_path: Optional[str]) -> VoskTranscriber:
+    return VoskTranscriber(model_path)
+
+def get_transcriber(model_path: str = None) -> VoskTranscriber:
+    """Process-wide VoskTranscriber, so the model is loaded from disk once.
+    
+    The instance's own recognizer is not reentrant; code sharing it across
+    threads should use transcribe_threadsafe.
+    """
+    transcriber = _load_transcriber(model_path)
+    if not transcriber.model_loaded:
+        # Not cached, so the next call retries once download-model has run
+        _load_transcriber.cache_clear()
+    return transcriber
+
+def download_model(model_size: str = "small", models_dir: str = MODELS_DIR, sha256: Optional[str] = None) -> Path:
+    """Download and extract a Vosk model, optionally checking the archive's sha256"""
+    name = VOSK_MODELS[model_size]
+    model_path = Path(models_dir) / name
+    if model_path.exists():
+        logger.info(f"Vosk model already present at {model_path}")
+        return model_path
+    
+    os.makedirs(models_dir, exist_ok=True)
+    
+    import tempfile
+    import zipfile
+    
+    model_url = VOSK_MODEL_URL.format(name=name)
+    
+    logger.info(f"Downloading Vosk model from {model_url} (this may take a few minutes)...")
+    digest = hashlib.sha256()
+    # Small archives stay in memory, larger ones spill to an anonymous temp
+    # file that goes away on close, so there is no model.zip to clean up
+    with requests.get(model_url, stream=True, timeout=60) as response, \
+            tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as archive:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            archive.write(chunk)
+        
+        if sha256 is not None and digest.hexdigest() != sha256.lower():
+            raise ValueError(f"Checksum mismatch for {model_url}: expected {sha256}, got {digest.hexdigest()}")
+        
+        logger.info("Extracting model...")
+        archive.seek(0)
+        with zipfile.ZipFile(archive, 'r') as zip_ref:
+            zip_ref.extractall(models_dir)
+    
+    logger.info(f"Model download completed (sha256 {digest.hexdigest()})")
+    return model_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vosk model management")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    download = subcommands.add_parser("download-model", help="Download a Vosk model into the models directory")
+    download.add_argument("--size", choices=sorted(VOSK_MODELS), default=os.environ.get("VOSK_MODEL_SIZE", "small"))
+    download.add_argument("--models-dir", default=MODELS_DIR)
+    download.add_argument("--sha256", help="Expected sha256 of the model archive")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    download_model(args.size, args.models_dir, args.sha256)
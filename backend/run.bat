@@ -53,6 +53,9 @@ echo 🚀 Starting FastAPI server...
 echo API will be available at: http://localhost:8000
 echo API docs available at: http://localhost:8000/docs
 echo.
+echo Transcriptions run on a separate Celery worker (requires Redis):
+echo   celery -A app.celery_app worker -Q decode,transcribe --loglevel=info --pool=solo
+echo.
 echo Press Ctrl+C to stop the server
 echo.
 
@@ -47,18 +47,17 @@ def test_audio_processing():
         t = np.linspace(0, duration, int(sample_rate * duration), False)
         audio_data = 0.3 * np.sin(2 * np.pi * frequency * t)
         
-        # Save as WAV
-        temp_wav = tempfile.mktemp(suffix='.wav')
-        sf.write(temp_wav, audio_data, sample_rate, subtype='PCM_16')
-        
-        print(f"✅ Created test WAV file: {temp_wav}")
-        
-        # Verify the file
-        with wave.open(temp_wav, 'rb') as wf:
-            print(f"✅ WAV file verified: {wf.getnchannels()} channels, {wf.getframerate()} Hz, {wf.getsampwidth()} bytes/sample")
+        # Save as WAV; the directory and file are removed on exit, even on errors
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_wav = os.path.join(temp_dir, "test.wav")
+            sf.write(temp_wav, audio_data, sample_rate, subtype='PCM_16')
+            
+            print(f"✅ Created test WAV file: {temp_wav}")
+            
+            # Verify the file
+            with wave.open(temp_wav, 'rb') as wf:
+                print(f"✅ WAV file verified: {wf.getnchannels()} channels, {wf.getframerate()} Hz, {wf.getsampwidth()} bytes/sample")
         
-        # Clean up
-        os.remove(temp_wav)
         print("✅ Test audio file cleaned up")
         
         return True
@@ -0,0 +1,44 @@
+"""Rule-based extraction matches the original substring scan."""
+
+import pytest
+
+from app.ner_processor import DIAGNOSIS_KEYWORDS, TREATMENT_KEYWORDS, BioBERTProcessor
+
+
+def substring_scan(text):
+    """The keyword scan _match_keywords replaced"""
+    text_lower = text.lower()
+    return {
+        'diagnosis': ', '.join(kw for kw in DIAGNOSIS_KEYWORDS if kw in text_lower),
+        'treatment': ', '.join(kw for kw in TREATMENT_KEYWORDS if kw in text_lower),
+        'extraction_method': 'rule-based',
+    }
+
+
+NOTES = [
+    "Patient presented with elevated temperature and lethargy. Prescribed doxycycline for suspected tick-borne infection.",
+    "Vomiting and diarrhea for two days, start IV fluids and a bland diet. Recheck if the fever persists.",
+    "Lameness in the left hind leg, radiographs show a fracture. Cast applied, strict rest and pain relief.",
+    "Owner says the dog showed no interest in food; weather forecast unrelated.",
+    "ANTIBIOTICS given, then antibiotic course continued. Anti-Inflammatory therapy started.",
+    "Itchy skin, dermatitis secondary to fleas and ticks, no sign of parasites or worms.",
+    "Routine vaccination, no findings.",
+    "",
+]
+
+
+@pytest.mark.parametrize("note", NOTES)
+def test_matches_substring_scan(note):
+    assert BioBERTProcessor()._extract_with_rules(note) == substring_scan(note)
+
+
+def test_keywords_inside_longer_words_still_match():
+    # Plain substring semantics, as before: "rest" in "interest", "cast" in "forecast"
+    result = BioBERTProcessor()._extract_with_rules("No interest in food, forecast says rain")
+    assert result['treatment'] == 'rest, cast'
+
+
+def test_overlapping_keywords_are_all_found():
+    result = BioBERTProcessor()._extract_with_rules("Elevated temperature noted, antibiotics started")
+    assert result['diagnosis'] == 'elevated temperature, temperature'
+    assert result['treatment'] == 'antibiotic, antibiotics'
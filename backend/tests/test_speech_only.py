@@ -0,0 +1,81 @@
+"""VoskTranscriber._speech_only against a stub VAD.
+
+Frame i of the synthetic audio is filled with the value i + 1, and the
+stub calls a frame speech when its index is in the given set, so the
+expected output can be spelled out frame by frame.
+"""
+
+import numpy as np
+import pytest
+
+from app import transcription
+from app.transcription import VAD_FRAME_SAMPLES, VAD_PAD, VAD_PREROLL_FRAMES
+
+
+class StubVad:
+    def __init__(self, speech):
+        self.speech = set(speech)
+
+    def is_speech(self, frame, sample_rate):
+        index = np.frombuffer(frame, dtype=np.int16)[0] - 1
+        return int(index) in self.speech
+
+
+def frame(index):
+    return np.full(VAD_FRAME_SAMPLES, index + 1, dtype=np.int16).tobytes()
+
+
+def samples(n_frames, tail=0):
+    """n_frames marked frames followed by tail samples of a partial frame"""
+    audio = b"".join(frame(i) for i in range(n_frames)) + frame(n_frames)[:tail * 2]
+    return np.frombuffer(audio, dtype=np.int16)
+
+
+def speech_only(speech, audio, block_frames=None):
+    transcriber = transcription.VoskTranscriber.__new__(transcription.VoskTranscriber)
+    transcriber.vad = StubVad(speech)
+    step = len(audio) if block_frames is None else block_frames * VAD_FRAME_SAMPLES
+    blocks = [audio[i:i + step] for i in range(0, len(audio), step)]
+    return b"".join(transcriber._speech_only(blocks))
+
+
+def test_speech_run_gets_preroll_and_pad():
+    speech = range(15, 20)
+    expected = b"".join(frame(i) for i in range(15 - VAD_PREROLL_FRAMES, 20)) + VAD_PAD
+    assert speech_only(speech, samples(30)) == expected
+
+
+def test_preroll_is_limited_to_what_came_before():
+    expected = b"".join(frame(i) for i in range(0, 5)) + VAD_PAD
+    assert speech_only(range(3, 5), samples(10)) == expected
+
+
+def test_preroll_is_not_repeated_between_runs():
+    # Frames 6-7 sit between two runs and are the second run's only preroll
+    expected = (b"".join(frame(i) for i in range(0, 6)) + VAD_PAD
+                + b"".join(frame(i) for i in range(6, 10)) + VAD_PAD)
+    assert speech_only([4, 5, 8, 9], samples(12)) == expected
+
+
+@pytest.mark.parametrize("block_frames", [1, 3, 7, 16])
+def test_state_carries_across_blocks(block_frames):
+    speech = [12, 13, 14, 20, 21, 33]
+    audio = samples(40)
+    assert speech_only(speech, audio, block_frames) == speech_only(speech, audio)
+
+
+def test_open_run_is_padded_at_the_end_and_partial_frame_dropped():
+    audio = samples(6, tail=100)
+    expected = b"".join(frame(i) for i in range(0, 6)) + VAD_PAD
+    assert speech_only(range(4, 7), audio) == expected
+
+
+def test_silence_only_yields_nothing():
+    assert speech_only([], samples(20)) == b""
+
+
+def test_without_vad_blocks_pass_through():
+    transcriber = transcription.VoskTranscriber.__new__(transcription.VoskTranscriber)
+    transcriber.vad = None
+    audio = samples(5, tail=7)
+    assert b"".join(transcriber._speech_only([audio[:1000], audio[1000:]])) == audio.tobytes()
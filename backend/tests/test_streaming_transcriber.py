@@ -0,0 +1,128 @@
+"""VoskStreamingTranscriber against a fake recognizer.
+
+The fake decodes synthetic PCM where every sample value is a word id
+(0 is silence), and like Vosk it keeps its clock running across Reset(),
+so word times are absolute over all audio ever fed to it.
+"""
+
+import numpy as np
+import orjson
+import pytest
+
+from app import transcription
+
+RATE = 16000
+ENDPOINT_SILENCE = RATE // 2
+# Shorter runs are noise, so audio cut from the middle of a word loses it
+MIN_WORD = RATE // 4
+
+
+class FakeRecognizer:
+    def __init__(self, model, sample_rate):
+        self.clock = 0
+        self.samples = np.zeros(0, dtype=np.int16)
+        self.start = 0
+
+    def SetWords(self, enabled):
+        pass
+
+    def SetPartialWords(self, enabled):
+        pass
+
+    def Reset(self):
+        self.samples = np.zeros(0, dtype=np.int16)
+        self.start = self.clock
+
+    def AcceptWaveform(self, data):
+        chunk = np.frombuffer(data, dtype=np.int16)
+        self.samples = np.concatenate([self.samples, chunk])
+        self.clock += len(chunk)
+        # Endpoint after a word followed by enough silence; audio past it
+        # is left out of the result, as with a real mid-chunk endpoint
+        for word in self._words():
+            silence_end = word["_end"] + ENDPOINT_SILENCE
+            if silence_end <= len(self.samples) and not self.samples[word["_end"]:silence_end].any():
+                self._result = self._dump("result", [w for w in self._words() if w["_end"] <= word["_end"]])
+                self.samples = np.zeros(0, dtype=np.int16)
+                self.start = self.clock
+                return True
+        return False
+
+    def Result(self):
+        return self._result
+
+    def PartialResult(self):
+        # Only words already followed by silence, the last one may still be spoken
+        finished = [w for w in self._words() if w["_end"] < len(self.samples)]
+        return self._dump("partial_result", finished)
+
+    def FinalResult(self):
+        result = self._dump("result", self._words())
+        self.Reset()
+        return result
+
+    def _words(self):
+        words, i, values = [], 0, self.samples
+        while i < len(values):
+            if values[i]:
+                j = i
+                while j < len(values) and values[j] == values[i]:
+                    j += 1
+                if j - i >= MIN_WORD:
+                    words.append({"word": f"w{values[i]}", "_start": i, "_end": j})
+                i = j
+            else:
+                i += 1
+        return words
+
+    def _dump(self, key, words):
+        result = [
+            {"word": w["word"], "start": (self.start + w["_start"]) / RATE, "end": (self.start + w["_end"]) / RATE}
+            for w in words
+        ]
+        payload = {key: result}
+        if key == "result":
+            payload["text"] = " ".join(w["word"] for w in result)
+        return orjson.dumps(payload)
+
+
+def speech(*segments):
+    """Build PCM from (word id, seconds) pairs, id 0 being silence"""
+    return np.concatenate([np.full(int(seconds * RATE), value, dtype=np.int16) for value, seconds in segments]).tobytes()
+
+
+@pytest.fixture
+def streamer(monkeypatch):
+    monkeypatch.setattr(transcription.vosk, "KaldiRecognizer", FakeRecognizer)
+    transcriber = transcription.VoskTranscriber.__new__(transcription.VoskTranscriber)
+    transcriber.model_loaded = True
+    transcriber.model = None
+
+    def make(**kwargs):
+        return transcription.VoskStreamingTranscriber(transcriber, **kwargs)
+
+    return make
+
+
+def transcribe(streamer, audio, **kwargs):
+    chunks = [audio[i:i + 3200] for i in range(0, len(audio), 3200)]
+    return " ".join(streamer(**kwargs).stream_transcribe(chunks)).split()
+
+
+def test_flush_returns_uncommitted_words_once(streamer):
+    audio = speech((1, 0.3), (0, 0.1), (2, 0.3), (0, 0.1), (3, 0.3))
+    assert transcribe(streamer, audio, chunk_seconds=0.2) == ["w1", "w2", "w3"]
+
+
+def test_endpoint_keeps_audio_after_it(streamer):
+    # The chunk that completes the endpoint silence already holds w3
+    audio = speech((1, 0.3), (0, 0.1), (2, 0.3), (0, 0.6), (3, 0.3), (0, 0.1), (4, 0.3))
+    assert transcribe(streamer, audio, chunk_seconds=1.0) == ["w1", "w2", "w3", "w4"]
+
+
+def test_trim_cuts_at_last_committed_word(streamer):
+    segments = []
+    for word in range(1, 9):
+        segments += [(word, 0.3), (0, 0.1)]
+    audio = speech(*segments)
+    assert transcribe(streamer, audio, chunk_seconds=0.2, buffer_seconds=1.0) == [f"w{i}" for i in range(1, 9)]
@@ -0,0 +1,78 @@
+"""_pcm_data_range against hand-built RIFF headers."""
+
+import struct
+
+import pytest
+
+from app.audio import _pcm_data_range
+
+
+def chunk(chunk_id, body, size=None):
+    """A RIFF chunk, padded to an even length; size overrides the header field"""
+    header = struct.pack('<4sI', chunk_id, len(body) if size is None else size)
+    return header + body + (b'\0' if len(body) & 1 else b'')
+
+
+def fmt(audio_format=1, channels=1, sample_rate=16000, bits=16, extra=b''):
+    block_align = channels * bits // 8
+    body = struct.pack('<HHIIHH', audio_format, channels, sample_rate, sample_rate * block_align, block_align, bits)
+    return chunk(b'fmt ', body + extra)
+
+
+def wav(*chunks):
+    body = b'WAVE' + b''.join(chunks)
+    return struct.pack('<4sI', b'RIFF', len(body)) + body
+
+
+def test_plain_wav():
+    buf = wav(fmt(), chunk(b'data', bytes(100)))
+    assert _pcm_data_range(buf) == (44, 144)
+
+
+def test_odd_size_chunk_is_padded():
+    # 12-byte RIFF header, 24-byte fmt, 8 + 3 + 1 pad byte of LIST, then data's header
+    buf = wav(fmt(), chunk(b'LIST', b'abc'), chunk(b'data', bytes(10)))
+    assert _pcm_data_range(buf) == (56, 66)
+
+
+def test_data_before_fmt():
+    with pytest.raises(ValueError, match="before its format"):
+        _pcm_data_range(wav(chunk(b'data', bytes(10)), fmt()))
+
+
+def test_unpatched_data_size_is_clamped_to_the_file():
+    buf = wav(fmt()) + struct.pack('<4sI', b'data', 0xFFFFFFFF) + bytes(100)
+    assert _pcm_data_range(buf) == (44, 144)
+
+
+def test_truncated_odd_tail_ends_on_a_whole_sample():
+    buf = wav(fmt(), chunk(b'data', bytes(100)))[:44 + 51]
+    assert _pcm_data_range(buf) == (44, 94)
+
+
+def test_wave_format_extensible():
+    # cbSize, valid bits, channel mask and the PCM sub-format GUID
+    extra = struct.pack('<HHI', 22, 16, 4) + bytes.fromhex('0100000000001000800000aa00389b71')
+    buf = wav(fmt(audio_format=0xFFFE, extra=extra), chunk(b'data', bytes(10)))
+    assert _pcm_data_range(buf) == (12 + 8 + 40 + 8, 12 + 8 + 40 + 8 + 10)
+
+
+@pytest.mark.parametrize("header", [
+    fmt(sample_rate=44100),
+    fmt(channels=2),
+    fmt(bits=24),
+    fmt(audio_format=3, bits=32),
+])
+def test_rejects_formats_vosk_cannot_read(header):
+    with pytest.raises(ValueError, match="16kHz mono PCM_16"):
+        _pcm_data_range(wav(header, chunk(b'data', bytes(10))))
+
+
+def test_not_a_wav():
+    with pytest.raises(ValueError, match="Not a WAV"):
+        _pcm_data_range(b'RIFX' + bytes(40))
+
+
+def test_no_data_chunk():
+    with pytest.raises(ValueError, match="no data chunk"):
+        _pcm_data_range(wav(fmt(), chunk(b'LIST', b'abcd')))
@@ -61,15 +61,8 @@ source venv/bin/activate
 pip install -r requirements.txt
 
 # Download Vosk model if not present
-if [ ! -d "models/vosk-model-en-us-0.22" ]; then
-    echo "🤖 Downloading Vosk model..."
-    mkdir -p models
-    cd models
-    wget https://alphacephei.com/vosk/models/vosk-model-en-us-0.22.zip
-    unzip vosk-model-en-us-0.22.zip
-    rm vosk-model-en-us-0.22.zip
-    cd ..
-fi
+echo "🤖 Downloading Vosk model..."
+python -m app.transcription download-model
 
 # Set up frontend
 echo "🎨 Setting up frontend..."